@@ -0,0 +1,17 @@
+import os
+
+from setuptools import setup
+
+ext_modules = []
+if os.name == 'posix':
+    # The C walk is optional: without Cython or a compiler, the pure-Python walk of `tglib.path` is used
+    try:
+        from Cython.Build import cythonize
+    except ImportError:
+        pass
+    else:
+        ext_modules = cythonize('tglib/_path_walk.pyx')
+        for ext in ext_modules:
+            ext.optional = True
+
+setup(ext_modules=ext_modules)
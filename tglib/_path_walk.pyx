@@ -0,0 +1,170 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+Directory walk of `PathIterator` implemented on `opendir`/`readdir`.
+
+Only user filters are called back into Python. The order of yielded items is the same as the pure-Python walk.
+"""
+from cpython.unicode cimport PyUnicode_Decode
+from libc.string cimport strlen
+
+import os
+import sys
+
+# Names are decoded as `os.fsdecode` does
+cdef bytes _FS_ENCODING = sys.getfilesystemencoding().encode()
+cdef bytes _FS_ERRORS = sys.getfilesystemencodeerrors().encode()
+
+
+cdef extern from "<dirent.h>" nogil:
+    ctypedef struct DIR
+    struct dirent:
+        unsigned char d_type
+        char d_name[1]
+    DIR *opendir(const char *name)
+    dirent *readdir(DIR *dirp)
+    int closedir(DIR *dirp)
+    int dirfd(DIR *dirp)
+    enum:
+        DT_UNKNOWN
+        DT_DIR
+        DT_LNK
+
+
+cdef extern from "<fcntl.h>" nogil:
+    enum:
+        AT_SYMLINK_NOFOLLOW
+
+
+cdef extern from "<sys/stat.h>" nogil:
+    ctypedef unsigned int mode_t
+    struct stat:
+        mode_t st_mode
+    int fstatat(int dirfd, const char *pathname, stat *buf, int flags)
+    bint S_ISDIR(mode_t mode)
+    bint S_ISLNK(mode_t mode)
+
+
+# Kinds of entries
+cdef enum:
+    _FILE = 0
+    _DIR = 1
+    _DIR_LINK = 2
+
+
+cdef int _kind(DIR *dirp, dirent *ent) noexcept nogil:
+    """
+    Classify an entry, `fstatat` is only called for links and `DT_UNKNOWN`.
+    A link to a directory is `_DIR_LINK`, which is neither yielded nor walked, as `os.walk` does.
+    """
+    cdef stat st
+    cdef unsigned char d_type = ent.d_type
+    if d_type == DT_UNKNOWN:
+        if fstatat(dirfd(dirp), ent.d_name, &st, AT_SYMLINK_NOFOLLOW) != 0:
+            return _FILE
+        if S_ISDIR(st.st_mode):
+            return _DIR
+        if not S_ISLNK(st.st_mode):
+            return _FILE
+        d_type = DT_LNK
+    if d_type == DT_DIR:
+        return _DIR
+    if d_type == DT_LNK and fstatat(dirfd(dirp), ent.d_name, &st, 0) == 0 and S_ISDIR(st.st_mode):
+        return _DIR_LINK
+    return _FILE
+
+
+cdef inline bint _is_dot(const char *name) noexcept nogil:
+    """Whether a name is '.' or '..'."""
+    return name[0] == b'.' and (name[1] == 0 or (name[1] == b'.' and name[2] == 0))
+
+
+cdef list _listdir(str dir_path):
+    """
+    List a directory as `(name, kind)` tuples. A directory that cannot be read is treated as empty.
+    The GIL is released during directory I/O, as `os.scandir` does.
+    """
+    cdef bytes b_path = os.fsencode(dir_path)
+    cdef const char *c_path = b_path
+    cdef DIR *dirp
+    cdef dirent *ent
+    cdef char *c_name
+    cdef int kind
+    cdef list entries = []
+
+    with nogil:
+        dirp = opendir(c_path)
+    if dirp == NULL:
+        return entries
+    try:
+        while True:
+            with nogil:
+                while True:
+                    ent = readdir(dirp)
+                    if ent == NULL or not _is_dot(ent.d_name):
+                        break
+                if ent != NULL:
+                    kind = _kind(dirp, ent)
+            if ent == NULL:
+                break
+            # `ent` stays valid until the next `readdir` of this stream
+            c_name = ent.d_name
+            entries.append((PyUnicode_Decode(c_name, strlen(c_name), _FS_ENCODING, _FS_ERRORS), kind))
+    finally:
+        with nogil:
+            closedir(dirp)
+    return entries
+
+
+def walk(str root, bint matched, level, dir_filter, file_predicate, bint yield_dir, bint yield_file,
+         tuple log_formats=None):
+    """
+    Walk `root` recursively, the same as `PathIterator._walk` without workers or entries.
+
+    :param root: The directory to be walked.
+    :param matched: Whether `root` matches the directory name filter.
+    :param level: Recursive level. If `None`, all subdirectories will be walked.
+    :param dir_filter: Filter of directory paths, checked before a subdirectory is walked.
+    :param file_predicate: Predicate of file names. If None, every file is accepted.
+    :param yield_dir: Whether directories are yielded.
+    :param yield_file: Whether files are yielded.
+    :param log_formats: Formats of verbose messages of the current dir, a yielded dir and a yielded file.
+        If None, nothing is printed.
+    :return: A tuple of dir path and file name. If a dir is iterated, file name will be None.
+    """
+    cdef Py_ssize_t max_depth = -1 if level is None else level
+    cdef Py_ssize_t depth, i
+    cdef bint descend
+    cdef int kind
+    cdef str dir_path, prefix, name
+    cdef list subdirs
+    cdef bint verbose = log_formats is not None
+    cdef str fmt_current, fmt_dir, fmt_file
+    if verbose:
+        fmt_current, fmt_dir, fmt_file = log_formats
+    # Pending directories, the top of the stack is walked first
+    cdef list stack = [(root, 0, matched)]
+
+    while stack:
+        dir_path, depth, matched = stack.pop()
+        descend = max_depth < 0 or depth + 1 < max_depth
+        if verbose:
+            print(fmt_current % dir_path)
+        if matched and yield_dir:
+            if verbose:
+                print(fmt_dir % dir_path)
+            yield dir_path, None
+
+        prefix = dir_path if dir_path.endswith(os.sep) else dir_path + os.sep
+        subdirs = []
+        for name, kind in _listdir(dir_path):
+            if kind == _DIR:
+                # Check directory name, unmatched subtrees are never opened
+                if descend and dir_filter(prefix + name):
+                    subdirs.append(prefix + name)
+            elif kind == _FILE and matched and yield_file and (file_predicate is None or file_predicate(name)):
+                if verbose:
+                    print(fmt_file % (prefix + name))
+                yield dir_path, name
+
+        for i in range(len(subdirs) - 1, -1, -1):
+            stack.append((subdirs[i], depth + 1, True))
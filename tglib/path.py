@@ -1,17 +1,218 @@
+import errno
 import os
 import re
-from os.path import join, exists, normpath, splitext, sep
+import stat
+import sys
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from os.path import join, normpath, splitext, sep, altsep
 from collections.abc import Iterable, Callable
 from typing import Any, TypeVar, NewType
 
 __all__ = ['PathIterator']
 
+try:
+    import ctypes
+except ImportError:  # pragma: no cover
+    ctypes = None
+
+try:
+    from ._path_walk import walk as _c_walk
+except ImportError:  # Extension not built, e.g. on Windows or without Cython
+    _c_walk = None
+
 FileName = NewType('FileName', str)
 DirName = NewType('DirName', str)
 
 FilterExtensionType = TypeVar('FilterExtensionType', str, Iterable[str], Callable[[str], bool])
 FilterPatternType = TypeVar('FilterPatternType', re.Pattern, Iterable[re.Pattern], Callable[[str], bool])
 
+# Formats of verbose messages of the iteration
+_FMT_CURRENT = '====== Current: [%s] ======'
+_FMT_DIR = '[D] "%s"'
+_FMT_FILE = '[F] "%s"'
+
+_AT_FDCWD = -100
+_AT_STATX_DONT_SYNC = 0x4000
+_STATX_TYPE = 0x0001
+
+
+def _load_statx():
+    """Return the `statx` function of libc if available (Linux >= 4.11 and glibc >= 2.28), else None."""
+    if ctypes is None or not sys.platform.startswith('linux'):
+        return None
+    try:
+        func = ctypes.CDLL(None, use_errno=True).statx
+    except (OSError, AttributeError):
+        return None
+    func.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_uint, ctypes.c_void_p]
+    func.restype = ctypes.c_int
+    return func
+
+
+_statx = _load_statx()
+
+if _statx is not None:
+    class _StatxBuffer(ctypes.Structure):
+        # Only the head of `struct statx` is needed, the rest is kept as padding (256 bytes in total).
+        _fields_ = [('stx_mask', ctypes.c_uint32),
+                    ('stx_blksize', ctypes.c_uint32),
+                    ('stx_attributes', ctypes.c_uint64),
+                    ('stx_nlink', ctypes.c_uint32),
+                    ('stx_uid', ctypes.c_uint32),
+                    ('stx_gid', ctypes.c_uint32),
+                    ('stx_mode', ctypes.c_uint16),
+                    ('_spare', ctypes.c_uint8 * 226)]
+
+
+def _fast_type(path: str) -> int:
+    """
+    Get the mode of `path`, only the file type bits are guaranteed.
+    On Linux, `statx` is called with `AT_STATX_DONT_SYNC` so that cached attributes are used.
+    Otherwise (or if `statx` is not permitted), fall back to `os.stat`.
+
+    :param path: A path to be probed.
+    :return: The `st_mode` of the path.
+    :raise OSError: When the path does not exist or cannot be accessed.
+    :raise ValueError: When the path contains an embedded null byte.
+    """
+    global _statx
+    # `c_char_p` would cut the path at an embedded NUL, `os.stat` raises ValueError for it instead
+    if _statx is not None and '\0' not in path:
+        buf = _StatxBuffer()
+        if _statx(_AT_FDCWD, os.fsencode(path), _AT_STATX_DONT_SYNC, _STATX_TYPE, ctypes.byref(buf)) == 0:
+            if buf.stx_mask & _STATX_TYPE:
+                return buf.stx_mode
+        else:
+            err = ctypes.get_errno()
+            if err in (errno.ENOSYS, errno.EPERM):
+                _statx = None  # Syscall unavailable (old kernel or seccomp), never try again
+            else:
+                raise OSError(err, os.strerror(err), path)
+    return os.stat(path).st_mode
+
+
+def _always_true(_name: str) -> bool:
+    """A filter that accepts every name."""
+    return True
+
+
+def _maybe_normpath(path: str) -> str:
+    """
+    Normalize a path, skipping `normpath` if it is already normalized.
+    The check is conservative: no '.' or '..' component (nor any component starting with '.'),
+    no repeated or trailing separator, and no alternative separator.
+    """
+    if (path and path[0] != '.' and sep + '.' not in path and sep + sep not in path
+            and (path[-1] != sep or path == sep) and (altsep is None or altsep not in path)):
+        return path
+    return normpath(path)
+
+
+@lru_cache(maxsize=4096)
+def _norm(path: str) -> str:
+    """Normalize a path. Results are cached and interned so that equal paths share one string."""
+    return sys.intern(_maybe_normpath(path))
+
+
+@lru_cache(maxsize=256)
+def _build_ext_filter(exts: frozenset[str]) -> Callable[[str], bool]:
+    """Build a filter of normalized extensions. Instances with the same extensions share one filter."""
+    return exts.__contains__
+
+
+@lru_cache(maxsize=256)
+def _build_pattern_filter(patterns: tuple[re.Pattern, ...]) -> Callable:
+    """
+    Build a filter of name patterns. Instances with the same patterns share one filter.
+    Multiple patterns are combined into a single alternation, so that the regex engine matches them in one call.
+    Patterns with different flags or with groups (whose numbers would be shifted by combining, breaking
+    backreferences and conditionals) are matched one by one.
+    """
+    if len(patterns) == 1:
+        return patterns[0].match
+    flags = patterns[0].flags
+    if all(pat.flags == flags and pat.groups == 0 for pat in patterns):
+        try:
+            return re.compile('|'.join(f'(?:{pat.pattern})' for pat in patterns), flags).match
+        except re.error:
+            pass
+    return lambda fn: any(bool(pat.match(fn)) for pat in patterns)
+
+
+def _scandir(path: str) -> list[os.DirEntry]:
+    """List a directory with `os.scandir`. A directory that cannot be read is treated as empty, as `os.walk` does."""
+    try:
+        with os.scandir(path) as it:
+            return list(it)
+    except OSError:
+        return []
+
+
+class _PathEntry:
+    """
+    An entry of a path given directly rather than listed by `os.scandir`, with the interface of `os.DirEntry`.
+    Same as `os.DirEntry`, stat results are cached after the first call.
+    """
+
+    __slots__ = ('name', 'path', '_stat', '_lstat')
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+        self._stat = None
+        self._lstat = None
+
+    def __fspath__(self):
+        return self.path
+
+    def __repr__(self):
+        return f'<{type(self).__name__} {self.name!r}>'
+
+    def stat(self, *, follow_symlinks: bool = True) -> os.stat_result:
+        if follow_symlinks:
+            if self._stat is None:
+                self._stat = os.stat(self.path)
+            return self._stat
+        if self._lstat is None:
+            self._lstat = os.lstat(self.path)
+        return self._lstat
+
+    def inode(self) -> int:
+        return self.stat(follow_symlinks=False).st_ino
+
+    def _test_mode(self, test: Callable[[int], bool], follow_symlinks: bool) -> bool:
+        try:
+            return test(self.stat(follow_symlinks=follow_symlinks).st_mode)
+        except FileNotFoundError:
+            return False
+
+    def is_dir(self, *, follow_symlinks: bool = True) -> bool:
+        return self._test_mode(stat.S_ISDIR, follow_symlinks)
+
+    def is_file(self, *, follow_symlinks: bool = True) -> bool:
+        return self._test_mode(stat.S_ISREG, follow_symlinks)
+
+    def is_symlink(self) -> bool:
+        return self._test_mode(stat.S_ISLNK, False)
+
+
+def _fast_ext(name: str) -> str:
+    """
+    Get the lowercase extension of a file name without dot, e.g. 'a.TXT' -> 'txt'.
+    Same as `os.path.splitext`, leading dots do not start an extension, e.g. '.bashrc' or '..txt' -> ''.
+    """
+    i = name.rfind('.')
+    if i <= 0 or (name[0] == '.' and not name[:i].lstrip('.')):
+        return ''
+    return name[i + 1:].lower()
+
+
+def _split_ext(name: str) -> str:
+    """Get the extension of a file name as `os.path.splitext` does, e.g. 'a.TXT' -> '.TXT'."""
+    return splitext(name)[1]
+
+
 tmp = """
     Parameters
     ----------
@@ -22,14 +223,16 @@ tmp = """
         Recursive level. If `None`, all subdirectories will be iterated.
     root : str, default=''
         If not null string, the root path will concatenate to the front of all the paths.
-    filter_file_extension s: FilterExtensionType, default=None
+    filter_file_extensions : FilterExtensionType, default=None
         If not None, only file that matches given extensions will be yielded.
+        A function filter receives the extension as `os.path.splitext` gives, e.g. '.TXT'.
     filter_file_name : FilterPatternType, default=None
         If not None, only file whose name matches re pattern will be yielded.
     filter_dir_name : FilterPatternType, default=None
         If not None, only directory whose name matches re pattern will be yielded.
         Notice: This rule will affect directories of all files, including separate files in `paths`.
-    raise_not_found : bool, default=False
+        Subdirectories that do not match will not be walked into.
+    raise_not_found : bool, default=True
         If `True`, a FileNotFoundError will be raised when a file or a directory does not exist.
     yield_dir : bool, default=False
         If `True`, directories will be yielded all alone.
@@ -51,19 +254,31 @@ class PathIterator:
         Recursive level. If `None`, all subdirectories will be iterated.
     root : str, default=''
         If not null string, the root path will concatenate to the front of all the paths.
-    filter_file_extension s: FilterExtensionType, default=None
+    filter_file_extensions : FilterExtensionType, default=None
         If not None, only file that matches given extensions will be yielded.
+        A function filter receives the extension as `os.path.splitext` gives, e.g. '.TXT'.
     filter_file_name : FilterPatternType, default=None
         If not None, only file whose name matches re pattern will be yielded.
     filter_dir_name : FilterPatternType, default=None
         If not None, only directory whose name matches re pattern will be yielded.
         Notice: This rule will affect directories of all files, including separate files in `paths`.
-    raise_not_found : bool, default=False
+        Subdirectories that do not match will not be walked into.
+    raise_not_found : bool, default=True
         If `True`, a FileNotFoundError will be raised when a file or a directory does not exist.
     yield_dir : bool, default=False
         If `True`, directories will be yielded all alone.
     verbose : bool, default=False
         Print more info.
+    workers : int, default=1
+        Number of threads that list directories ahead of the iteration, which helps on network or cold storage.
+        The order of yielded items is the same for any number of workers. If 1, directories are listed in place.
+    yield_entries : bool, default=False
+        If `True`, `os.DirEntry` objects are yielded instead of tuples, so that `entry.path`, `entry.name`
+        and the cached `entry.stat(follow_symlinks=False)` are available without another stat call.
+        Paths given directly in `paths` are yielded as objects with the same interface.
+
+    Notice: If the C extension `tglib._path_walk` is built (POSIX with Cython), directories are walked by it,
+    except when `workers` > 1 or `yield_entries` is True, which only the pure-Python walk supports.
     """
 
     SEP = sep
@@ -77,7 +292,9 @@ class PathIterator:
                  filter_dir_name: FilterPatternType = None,
                  raise_not_found: bool = True,
                  yield_dir: bool = True,
-                 verbose: bool = True):
+                 verbose: bool = True,
+                 workers: int = 1,
+                 yield_entries: bool = False):
         """TODO docstring
 
         :param paths:
@@ -89,61 +306,149 @@ class PathIterator:
         :param raise_not_found:
         :param yield_dir:
         :param verbose:
+        :param workers:
+        :param yield_entries:
         """
         self.verbose = verbose
 
         if isinstance(paths, str):
             paths = [paths]
-        self.paths = [normpath(join(root, p)) for p in paths]
-        self.level = level
+        # The root is normalized once, and only joined if given
         self.root = normpath(root)
+        self.paths = [_norm(join(self.root, p) if root else p) for p in paths]
+        self.level = level
 
         self.f_file_ext: Callable = self._wrapper_filter_extension(filter_file_extensions)
         self.f_file_name: Callable = self._wrapper_filter_pattern(filter_file_name)
         self.f_dir_name: Callable = self._wrapper_filter_pattern(filter_dir_name)
+        # A function filter of extensions keeps receiving the raw extension, built-in ones a normalized one
+        ext_of_name = _split_ext if self.f_file_ext is filter_file_extensions else _fast_ext
+        self._file_predicate: Callable | None = self._compose_file_predicate(
+            self.f_file_name, self.f_file_ext, ext_of_name)
 
         self.raise_not_found = raise_not_found
         self.yield_dir = yield_dir
+        self.workers = workers
+        self.yield_entries = yield_entries
 
         assert self.level is None or self.level > 0, 'Level should be as least 1.'
+        assert self.workers > 0, 'Workers should be as least 1.'
 
     def __iter__(self):
         """
         :return: A tuple of dir path and file name. If a dir is iterated, file name will be None.
+            If `yield_entries` is True, an `os.DirEntry` of the file or the dir instead.
         """
-        for root in self.paths:
-            root = normpath(root)
-            if os.path.isdir(root):
-
-                if self.raise_not_found and not exists(root):
-                    raise FileNotFoundError(root)
-
-                level_root = root.count(PathIterator.SEP)
-                for dir_path, dirs, files in os.walk(root):
-                    self._verbose_print(f'====== Current: [{dir_path}] ======')
-
-                    # Check directory level
-                    level_dir = dir_path.count(PathIterator.SEP)
-                    if self.level is not None and level_dir >= level_root + self.level:
-                        continue
-
-                    # Check directory name
-                    if not self.f_dir_name(dir_path):
-                        continue
-                    if self.yield_dir:
-                        self._verbose_print(f'[D] "{dir_path}"')
-                        yield dir_path, None
-
-                    # Iterate files in the dir_path
-                    for file in files:
-                        if self.f_file_name(file) and self.f_file_ext(splitext(file)[1]):
-                            self._verbose_print(f'[F] "{join(dir_path, file)}"')
-                            yield dir_path, file
-            else:  # File or link
-                dir_path, file = os.path.split(root)
-                if self.f_dir_name(dir_path) and self.f_file_name(file) and self.f_file_ext(splitext(file)[1]):
-                    self._verbose_print(f'[F] "{join(dir_path, file)}"')
-                    yield dir_path, file
+        return self._iter(self.yield_dir, True, self.yield_entries)
+
+    def _iter(self, yield_dir: bool, yield_file: bool, yield_entries: bool):
+        """
+        Iterate over all paths, yielding only the kinds of item that are asked for.
+
+        :param yield_dir: Whether directories are yielded.
+        :param yield_file: Whether files are yielded. If `False`, file filters are not evaluated at all.
+        :param yield_entries: Whether `os.DirEntry` objects are yielded instead of tuples.
+        :return: A tuple of dir path and file name. If a dir is iterated, file name will be None.
+        """
+        file_predicate, f_dir_name = self._file_predicate, self.f_dir_name
+        verbose, raise_not_found = self.verbose, self.raise_not_found
+        norm, fast_type, is_dir, lexists = _norm, _fast_type, stat.S_ISDIR, os.path.lexists
+        split, walk = os.path.split, self._walk
+
+        # Directories are listed by a thread pool ahead of the iteration if there are multiple workers
+        executor = ThreadPoolExecutor(self.workers) if self.workers > 1 else None
+        submit = None if executor is None else executor.submit
+        # The C walk is used if built, except for features only the pure-Python walk has
+        c_walk = _c_walk if executor is None and not yield_entries else None
+        log_formats = (_FMT_CURRENT, _FMT_DIR, _FMT_FILE) if verbose else None
+        level = self.level
+        try:
+            for root in self.paths:
+                root = norm(root)
+                try:
+                    mode = fast_type(root)
+                except OSError as e:
+                    # Only a missing path is raised, a broken link is not missing and is yielded as a file.
+                    # Any other error means not a directory, as `os.path.isdir` tells.
+                    if raise_not_found and e.errno == errno.ENOENT and not lexists(root):
+                        raise
+                    mode = 0
+                except ValueError:  # Embedded null byte, not a directory as `os.path.isdir` tells
+                    mode = 0
+
+                if is_dir(mode) and c_walk is not None:
+                    yield from c_walk(root, bool(f_dir_name(root)), level, f_dir_name, file_predicate,
+                                      yield_dir, yield_file, log_formats)
+                elif is_dir(mode):
+                    yield from walk(_PathEntry(root), 0, bool(f_dir_name(root)),
+                                    yield_dir, yield_file, yield_entries, None, submit)
+                elif yield_file:  # File or link
+                    dir_path, file = split(root)
+                    if f_dir_name(dir_path) and (file_predicate is None or file_predicate(file)):
+                        if verbose:
+                            print(_FMT_FILE % root)
+                        yield _PathEntry(root) if yield_entries else (dir_path, file)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def _walk(self, dir_entry: os.DirEntry | _PathEntry, depth: int, matched: bool,
+              yield_dir: bool, yield_file: bool, yield_entries: bool,
+              pending: Future | None, submit: Callable | None):
+        """
+        Recursively walk a directory with `os.scandir`, the type info of `os.DirEntry` is reused.
+
+        :param dir_entry: The entry of the directory to be walked.
+        :param depth: Depth of the directory below the iterated path, which is 0 itself.
+        :param matched: Whether the directory matches the directory name filter.
+            Subdirectories are checked before being walked, so only the iterated path itself may be unmatched.
+        :param yield_dir: Whether directories are yielded.
+        :param yield_file: Whether files are yielded.
+        :param yield_entries: Whether `os.DirEntry` objects are yielded instead of tuples.
+        :param pending: A future of the entries of the directory being listed. If None, it is listed in place.
+        :param submit: `submit` of the executor to list subdirectories ahead. If None, they are listed in place.
+        :return: A tuple of dir path and file name. If a dir is iterated, file name will be None.
+        """
+        # Check directory level, subdirectories beyond it are never listed
+        level = self.level
+        descend = level is None or depth + 1 < level
+
+        file_predicate, f_dir_name, verbose = self._file_predicate, self.f_dir_name, self.verbose
+        match_file = matched and yield_file
+        dir_path = dir_entry.path
+        if verbose:
+            print(_FMT_CURRENT % dir_path)
+
+        if matched and yield_dir:
+            if verbose:
+                print(_FMT_DIR % dir_path)
+            yield dir_entry if yield_entries else (dir_path, None)
+
+        entries = _scandir(dir_path) if pending is None else pending.result()
+
+        # Iterate files in the dir_path, subdirectories are walked after them
+        subdirs = []
+        for entry in entries:
+            name = entry.name
+            try:
+                is_dir = entry.is_dir()
+            except OSError:  # As `os.walk`, an entry that cannot be stat is not a directory
+                is_dir = False
+            if is_dir:
+                # Links to directories are neither yielded nor walked, as `os.walk` does
+                # Check directory name, unmatched subtrees are never opened
+                if descend and not entry.is_symlink():
+                    sub_path = entry.path
+                    if f_dir_name(sub_path):
+                        subdirs.append((entry, None if submit is None else submit(_scandir, sub_path)))
+            elif match_file and (file_predicate is None or file_predicate(name)):
+                if verbose:
+                    print(_FMT_FILE % entry.path)
+                yield entry if yield_entries else (dir_path, name)
+
+        walk = self._walk
+        for sub_entry, sub_pending in subdirs:
+            yield from walk(sub_entry, depth + 1, True, yield_dir, yield_file, yield_entries, sub_pending, submit)
 
     @staticmethod
     def _ext(ext: str):
@@ -153,16 +458,30 @@ class PathIterator:
         if self.verbose:
             print(*args, **kwargs)
 
+    @staticmethod
+    def _compose_file_predicate(f_file_name: Callable, f_file_ext: Callable,
+                                ext_of_name: Callable[[str], str]) -> Callable | None:
+        """
+        Fuse the file name and extension filters into one predicate of a file name.
+        `ext_of_name` gets the extension passed to `f_file_ext` from a file name.
+
+        :return: The predicate, or None if every file is accepted.
+        """
+        if f_file_ext is _always_true:
+            return None if f_file_name is _always_true else f_file_name
+        if f_file_name is _always_true:
+            return lambda name, f_ext=f_file_ext, ext=ext_of_name: f_ext(ext(name))
+        return lambda name, f_name=f_file_name, f_ext=f_file_ext, ext=ext_of_name: f_name(name) and f_ext(ext(name))
+
     def _wrapper_filter_extension(self, filter_obj: FilterExtensionType):
         if isinstance(filter_obj, str):
             self._verbose_print("Filter for extension: An extension string")
-            filter_obj = self._ext(filter_obj)
-            flt = lambda fn_ext: self._ext(fn_ext) == filter_obj
+            flt = _build_ext_filter(frozenset({self._ext(filter_obj)}))
         elif isinstance(filter_obj, Iterable):
-            filter_obj = [self._ext(ext) for ext in filter_obj]
+            filter_obj = list(filter_obj)
             if len(filter_obj) > 0 and all(isinstance(obj, str) for obj in filter_obj):
                 self._verbose_print("Filter for extension: An iterable of extension string")
-                flt = lambda fn_ext: self._ext(fn_ext) in filter_obj
+                flt = _build_ext_filter(frozenset(self._ext(ext) for ext in filter_obj))
             else:
                 raise TypeError("Only support iterable of extension string")
         elif callable(filter_obj):
@@ -170,7 +489,7 @@ class PathIterator:
             self._verbose_print("Filter for extension: A function")
             flt = filter_obj
         elif filter_obj is None:
-            flt = lambda fn: True
+            flt = _always_true
         else:
             raise TypeError('Unsupported filter type:', type(filter_obj))
         return flt
@@ -178,19 +497,19 @@ class PathIterator:
     def _wrapper_filter_pattern(self, filter_obj: FilterPatternType):
         if isinstance(filter_obj, re.Pattern):
             self._verbose_print("Filter for file/dir name: A re.Pattern")
-            flt = lambda fn: bool(filter_obj.match(fn))
+            flt = _build_pattern_filter((filter_obj,))
         elif isinstance(filter_obj, Iterable):
             filter_obj = list(filter_obj)
             if len(filter_obj) > 0 and all(isinstance(obj, re.Pattern) for obj in filter_obj):
                 self._verbose_print("Filter for file/dir name: An iterable of re.Pattern")
-                flt = lambda fn: any(bool(pat.match(fn)) for pat in filter_obj)
+                flt = _build_pattern_filter(tuple(filter_obj))
             else:
                 raise TypeError("Only support iterable of re.Pattern.")
         elif callable(filter_obj):
             self._verbose_print("Filter for file/dir name: A function")
             flt = filter_obj
         elif filter_obj is None:
-            flt = lambda fn: True
+            flt = _always_true
         else:
             raise TypeError('Unsupported filter type:', type(filter_obj))
         return flt
@@ -201,12 +520,25 @@ class PathIterator:
         """
         Traverse all files and dirs with given handler functions.
         (Notice: If yield_dir is False, `handler_dir` will have no effects.)
+        Handlers are called with paths even if `yield_entries` is True.
 
         :param handler_file: A handler function that accept a full file name.
         :param handler_dir: A handler function that accept a directory path.
         :return: None
         """
-        for dir_name, file in self:
+        yield_dir = self.yield_dir and handler_dir is not None
+        if handler_file is not None and not yield_dir:
+            # Files only, directories are never yielded
+            for dir_name, file in self._iter(False, True, False):
+                handler_file(dir_name, file)
+            return
+        if yield_dir and handler_file is None:
+            # Directories only, files are never filtered
+            for dir_name, _ in self._iter(True, False, False):
+                handler_dir(dir_name)
+            return
+
+        for dir_name, file in self._iter(self.yield_dir, True, False):
             if file is None:
                 if handler_dir is not None:
                     handler_dir(dir_name)